@@ -1,29 +1,73 @@
 #!/usr/bin/env python3
-import os, re, sys, json, pathlib
-import requests
-from bs4 import BeautifulSoup
-from slugify import slugify
+import os, re, sys, argparse, bisect, hashlib, pathlib
+from operator import itemgetter
+import ahocorasick
+import orjson
 
 # ---- Config
-USE_AI = bool(os.environ.get('OPENAI_API_KEY'))
+# opt-in: having the OPENAI_API_KEY secret configured must not by itself
+# switch every bookmark to a paid model call
+USE_AI = os.environ.get('AI_CATEGORIZE') == '1' and bool(os.environ.get('OPENAI_API_KEY'))
 ROOT = pathlib.Path(__file__).resolve().parents[1]
 INDEX = ROOT / 'index.html'
 CATEGORIES_DIR = ROOT / 'categories'
 DATA_DIR = ROOT / 'data'
 TEMPLATES_DIR = ROOT / 'templates'
 CATEGORY_TEMPLATE = TEMPLATES_DIR / 'category.html'
+AI_CACHE_PATH = DATA_DIR / '.ai_cache.json'
 
 CAT_START  = '<!-- AUTO-CATEGORIES:START -->'
 CAT_END    = '<!-- AUTO-CATEGORIES:END -->'
 
-session = requests.Session()
-session.headers.update({'User-Agent': 'DomainBookmarksBot/1.1'})
+POOL_SIZE = 16
+MAX_HTML_BYTES = 64 * 1024   # <meta>/<title> live in <head>; never read past this
+HTML_TYPES = ('text/html', 'application/xhtml+xml')
+
+# requests, selectolax, slugify and openai are imported on first use so the
+# no-URL error path (and any run that skips a stage) doesn't pay for them
+_http = None
+
+def _session():
+    global _http
+    if _http is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        s = requests.Session()
+        # br responses are decoded by urllib3 when the brotli package is installed
+        s.headers.update({'User-Agent': 'DomainBookmarksBot/1.1', 'Accept-Encoding': 'gzip, br',
+                          'Accept': 'text/html,application/xhtml+xml'})
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE,
+                              max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=(502, 503, 504)))
+        s.mount('http://', adapter)
+        s.mount('https://', adapter)
+        _http = s
+    return _http
+
+# Plain-ASCII names ("Domain Blogs", "WHOIS / Research") slug to the same
+# thing python-slugify would produce with a translate + collapse; anything
+# else (accents, entities, digit commas, stray symbols) goes to slugify.
+_SLUG_TR = str.maketrans({c: '-' for c in ' \t\r\n/\\_.:!?()[]{}"\'&'})
+_DASHES_RE = re.compile(r'-+')
+_SLUG_OK_RE = re.compile(r'[a-z0-9]+(?:-[a-z0-9]+)*')
+
+def _slug(text):
+    out = _DASHES_RE.sub('-', text.lower().translate(_SLUG_TR)).strip('-')
+    if _SLUG_OK_RE.fullmatch(out):
+        return out
+    from slugify import slugify
+    return slugify(text)
 
 # ---- Issue overrides
 CATEGORY_RE = re.compile(r'^Category:\s*(.+)$', re.I|re.M)
 GROUP_RE    = re.compile(r'^Group:\s*(.+)$', re.I|re.M)
 DESC_RE     = re.compile(r'^Description:\s*(.+)$', re.I|re.M)
 TITLE_RE    = re.compile(r'^Title:\s*(.+)$', re.I|re.M)
+URL_RE      = re.compile(r'https?://\S+')
+LI_RE       = re.compile(r'<li>.*?</li>', re.I|re.S)
+TAG_STRIP_RE = re.compile(r'<.*?>')
+HEAD_END_RE = re.compile(rb'</head\s*>', re.I)
+CAT_BLOCK_RE = re.compile(f'({re.escape(CAT_START)})(.*?)({re.escape(CAT_END)})', re.S)
 
 def read_override(rx, text):
     m = rx.search(text or '')
@@ -31,21 +75,47 @@ def read_override(rx, text):
 
 # ---- URL & metadata
 def first_url(text):
-    m = re.search(r'(https?://\S+)', text or '')
-    return m.group(1) if m else None
+    m = URL_RE.search(text or '')
+    return m.group(0) if m else None
+
+TITLE_SELECTORS = ('meta[property="og:title"]', 'meta[name="twitter:title"]', 'title')
+DESC_SELECTORS  = ('meta[name="description"]', 'meta[property="og:description"]',
+                   'meta[name="twitter:description"]')
+
+def first_match(tree, selectors):
+    for sel in selectors:
+        node = tree.css_first(sel)
+        if node is not None:
+            return node.attributes.get('content') or node.text(strip=True)
+    return None
+
+def read_head(r):
+    buf = bytearray()
+    for chunk in r.iter_content(MAX_HTML_BYTES):
+        start = max(0, len(buf) - 8)   # '</head>' may straddle two chunks
+        buf += chunk
+        m = HEAD_END_RE.search(buf, start)
+        if m:
+            return bytes(buf[:m.end()])
+        if len(buf) >= MAX_HTML_BYTES:
+            break
+    return bytes(buf[:MAX_HTML_BYTES])
 
 def fetch_meta(url):
-    r = session.get(url, timeout=20)
-    r.raise_for_status()
-    soup = BeautifulSoup(r.text, 'lxml')
-    def pick(selectors):
-        for sel in selectors:
-            el = soup.select_one(sel)
-            if el:
-                return el.get('content') or el.get_text(strip=True)
-        return None
-    title = pick(['meta[property="og:title"]','meta[name="twitter:title"]','title'])
-    desc  = pick(['meta[name="description"]','meta[property="og:description"]','meta[name="twitter:description"]'])
+    from selectolax.lexbor import LexborHTMLParser
+    r = _session().get(url, timeout=20, stream=True)
+    try:
+        r.raise_for_status()
+        # a link to a PDF/image/etc. has no <head> worth downloading
+        ctype = r.headers.get('Content-Type', '').lower()
+        if ctype and not ctype.startswith(HTML_TYPES):
+            return url, '', r.url
+        body = read_head(r)
+    finally:
+        r.close()
+    tree = LexborHTMLParser(body.decode(r.encoding or 'utf-8', errors='replace'))
+    title = first_match(tree, TITLE_SELECTORS)
+    desc  = first_match(tree, DESC_SELECTORS)
     return (title or url).strip(), (desc or '').strip(), r.url
 
 # ---- Fallback classification
@@ -58,40 +128,233 @@ KEYWORD_MAP = [
     ('Drops & Auctions', ['expired','auction','backorder','drop','closeout']),
     ('Brandable Marketplaces', ['brandable','brandbucket','atom','squadhelp']),
 ]
+# one automaton for every keyword; values carry KEYWORD_MAP order so the
+# earliest-listed category still wins when several match
+KEYWORD_AC = ahocorasick.Automaton()
+for prio,(name,kws) in enumerate(KEYWORD_MAP):
+    for kw in kws:
+        if kw not in KEYWORD_AC:
+            KEYWORD_AC.add_word(kw, (prio, name))
+KEYWORD_AC.make_automaton()
+
 def fallback_category(title, desc, url):
     t = f"{title} {desc} {url}".lower()
-    for name,kws in KEYWORD_MAP:
-        if any(kw in t for kw in kws):
-            return name
-    return 'General'
+    hits = [v for _,v in KEYWORD_AC.iter(t)]
+    return min(hits)[1] if hits else 'General'
+
+# ---- AI classification
+# sha1(url, title, desc) -> cleaned model reply; committed with the data so
+# re-submitted or edited issues don't pay for the same classification twice.
+# Loaded on first use only, so runs that never reach the model never read it.
+_ai_cache = None
+_ai_cache_dirty = False
+_ai = None
+
+def _ai_client():
+    global _ai
+    if _ai is None:
+        from openai import OpenAI
+        _ai = OpenAI()
+    return _ai
+
+# the model may only pick from the categories the keyword fallback knows, so
+# it can't invent new category pages
+AI_CATEGORIES = {name.lower(): name for name,_ in KEYWORD_MAP}
+AI_CATEGORIES['general'] = 'General'
+AI_FIELDS = ('category', 'group', 'short_title', 'description')
+
+AI_PROMPT = (
+    "You file links for a directory of domain-investing resources. "
+    "Reply with a JSON object with string keys: category (exactly one of "
+    f"{', '.join(AI_CATEGORIES.values())}), group (optional sub-heading), "
+    "short_title (max 60 chars) and description (one sentence, max 220 chars)."
+)
+
+def clean_ai_reply(data):
+    # anything not matching the expected shape is dropped (-> keyword fallback)
+    if not isinstance(data, dict):
+        return None
+    if any(data.get(k) is not None and not isinstance(data[k], str) for k in AI_FIELDS):
+        return None
+    category = AI_CATEGORIES.get((data.get('category') or '').strip().lower())
+    if not category:
+        return None
+    out = {'category': category}
+    out.update({k: data[k].strip() for k in AI_FIELDS[1:] if (data.get(k) or '').strip()})
+    return out
+
+def _load_ai_cache():
+    global _ai_cache
+    if _ai_cache is None:
+        _ai_cache = {}
+        if AI_CACHE_PATH.exists():
+            try:
+                data = orjson.loads(AI_CACHE_PATH.read_bytes())
+            except orjson.JSONDecodeError as e:
+                data = None
+                print(f'::warning::Ignoring unreadable {AI_CACHE_PATH.name}: {e}')
+            if isinstance(data, dict):
+                _ai_cache = data
+    return _ai_cache
+
+def ai_categorize(title, desc, url):
+    global _ai_cache_dirty
+    cache = _load_ai_cache()
+    key = hashlib.sha1(f"{url}\x00{title}\x00{desc}".encode()).hexdigest()
+    if key in cache:
+        return clean_ai_reply(cache[key])
+    resp = _ai_client().chat.completions.create(
+        model='gpt-4o-mini',
+        temperature=0.2,
+        response_format={'type': 'json_object'},
+        messages=[{'role': 'system', 'content': AI_PROMPT},
+                  {'role': 'user', 'content': f"URL: {url}\nTitle: {title}\nDescription: {desc}"}],
+    )
+    # JSON mode guarantees valid JSON only for a complete reply, and never the shape
+    choice = resp.choices[0]
+    if choice.finish_reason != 'stop':
+        print(f'::warning::AI reply incomplete ({choice.finish_reason}), using keyword fallback')
+        return None
+    try:
+        data = clean_ai_reply(orjson.loads(choice.message.content or ''))
+    except orjson.JSONDecodeError:
+        data = None
+    if data:
+        cache[key] = data
+        _ai_cache_dirty = True
+    return data
+
+def flush_ai_cache():
+    global _ai_cache_dirty
+    if _ai_cache_dirty:
+        DATA_DIR.mkdir(exist_ok=True)
+        # one sorted entry per line, so bookmark PRs touching the cache
+        # merge line by line instead of all conflicting on a single line
+        AI_CACHE_PATH.write_bytes(orjson.dumps(_ai_cache, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS))
+        _ai_cache_dirty = False
 
 # ---- JSON helpers
+# path -> (mtime_ns, parsed data); refreshed by save_category_json so repeated
+# loads of the same category within one run skip the read + decode.
+_JSON_CACHE = {}
+
+def _read_json(path):
+    mtime = path.stat().st_mtime_ns
+    hit = _JSON_CACHE.get(path)
+    if hit and hit[0] == mtime:
+        return hit[1]
+    data = orjson.loads(path.read_bytes())
+    _add_sort_keys(data)
+    _JSON_CACHE[path] = (mtime, data)
+    return data
+
 def load_category_json(slug, category_name):
     DATA_DIR.mkdir(exist_ok=True)
     path = DATA_DIR / f"{slug}.json"
     if path.exists():
-        data = json.loads(path.read_text(encoding='utf-8'))
+        data = _read_json(path)
         data.setdefault('category', category_name or data.get('category') or slug)
         data.setdefault('groups', [])
     else:
         data = {'category': category_name, 'groups': []}
     return data, path
 
+def _public(obj):
+    # drop the in-memory '_*' lookup keys before serialising
+    if isinstance(obj, dict):
+        return {k: _public(v) for k, v in obj.items() if not k.startswith('_')}
+    if isinstance(obj, list):
+        return [_public(v) for v in obj]
+    return obj
+
+def save_category_json(data, path):
+    path.write_bytes(orjson.dumps(_public(data), option=orjson.OPT_INDENT_2))
+    _JSON_CACHE[path] = (path.stat().st_mtime_ns, data)
+
+# lowercased sort keys, computed once per load and kept next to the visible
+# fields (underscore keys are dropped by _public on save)
+GROUP_KEY = itemgetter('_name_lc')
+ITEM_KEY  = itemgetter('_title_lc')
+
+def _title_lc(x):
+    return (x.get('title') or '').lower()
+
+def _add_sort_keys(data):
+    for g in data.get('groups', []):
+        g['_name_lc'] = g['name'].lower()
+        for it in g.get('items', []):
+            it['_title_lc'] = _title_lc(it)
+
+def _insort(seq, obj, key, first=False):
+    # Mirrors where a stable re-sort would leave obj among equal keys: appended
+    # (new) entries land last; a retitled entry lands first if its old key
+    # sorted below the new one (it sat before that run), otherwise last.
+    find = bisect.bisect_left if first else bisect.bisect_right
+    seq.insert(find(seq, key(obj), key=key), obj)
+
+def _unsort(seq, obj, key):
+    pos = bisect.bisect_left(seq, key(obj), key=key)
+    while seq[pos] is not obj:
+        pos += 1
+    del seq[pos]
+
+def _url_index(items):
+    # reversed so that, like the old linear scan, the first entry wins when
+    # several normalise to the same URL
+    return {x['url'].rstrip('/'): x for x in reversed(items)}
+
 def upsert_item(data, group_name, item):
     group_name = (group_name or 'General').strip()
     groups = data['groups']
-    g = next((g for g in groups if g['name'].lower()==group_name.lower()), None)
+    group_index = data.get('_group_index')
+    groups_first_touch = group_index is None
+    if groups_first_touch:
+        # the first lookup sees the file order; the lists are sorted once at
+        # the end of this call and kept sorted by insertion afterwards
+        group_index = {x['_name_lc']: x for x in reversed(groups)}
+    g = group_index.get(group_name.lower())
     if not g:
-        g = {'name': group_name, 'items': []}
-        groups.append(g)
+        g = group_index[group_name.lower()] = {'name': group_name, 'items': [], '_name_lc': group_name.lower()}
+        if groups_first_touch:
+            groups.append(g)
+        else:
+            _insort(groups, g, GROUP_KEY)
     items = g['items']
-    existing = next((x for x in items if x['url'].rstrip('/') == item['url'].rstrip('/')), None)
+    url_index = g.get('_url_index')
+    items_first_touch = url_index is None
+    if items_first_touch:
+        url_index = _url_index(items)
+    url_key = item['url'].rstrip('/')
+    existing = url_index.get(url_key)
     if existing:
         existing.update({k:v for k,v in item.items() if v})
+        old_lc, new_lc = existing['_title_lc'], _title_lc(existing)
+        if items_first_touch or new_lc == old_lc:
+            existing['_title_lc'] = new_lc
+        else:
+            _unsort(items, existing, ITEM_KEY)   # located under its old key
+            existing['_title_lc'] = new_lc
+            _insort(items, existing, ITEM_KEY, first=old_lc < new_lc)
+            if g['_dup_urls']:
+                # moving an entry can change which duplicate now sorts first
+                g['_url_index'] = _url_index(items)
     else:
-        items.append(item)
-    items.sort(key=lambda x: (x.get('title') or '').lower())
-    groups.sort(key=lambda x: x['name'].lower())
+        item['_title_lc'] = _title_lc(item)
+        url_index[url_key] = item
+        if items_first_touch:
+            items.append(item)
+        else:
+            _insort(items, item, ITEM_KEY)
+
+    # later lookups must hit the first match in *sorted* order, as the old
+    # scan over the re-sorted lists did
+    if groups_first_touch:
+        groups.sort(key=GROUP_KEY)
+        data['_group_index'] = {x['_name_lc']: x for x in reversed(groups)}
+    if items_first_touch:
+        items.sort(key=ITEM_KEY)
+        g['_url_index'] = _url_index(items)
+        g['_dup_urls'] = len(g['_url_index']) < len(items)
 
 def ensure_category_page(name, slug):
     CATEGORIES_DIR.mkdir(exist_ok=True)
@@ -103,62 +366,76 @@ def ensure_category_page(name, slug):
         path.write_text(html, encoding='utf-8')
     return path
 
+def _li_key(li):
+    return TAG_STRIP_RE.sub('', li).strip().lower()
+
 def ensure_category_link_on_index(name, slug):
     if not INDEX.exists(): return
     html = INDEX.read_text(encoding='utf-8')
-    link_li = f'<li><a href="categories/{slug}.html">{name}</a></li>'
-    start = html.find(CAT_START); end = html.find(CAT_END)
-    if start == -1 or end == -1 or end < start:
+    m = CAT_BLOCK_RE.search(html)
+    if not m:
+        return
+    middle = m.group(2)
+    # common case: already listed, so nothing to sort or write
+    if f'href="categories/{slug}.html"' in middle:
         return
-    before = html[:start+len(CAT_START)]
-    middle = html[start+len(CAT_START):end]
-    after = html[end:]
-    lis = re.findall(r'<li>.*?</li>', middle, flags=re.I|re.S)
-    if not any(f'href="categories/{slug}.html"' in li for li in lis):
-        lis.append(link_li)
-    lis_sorted = sorted(lis, key=lambda li: re.sub(r'<.*?>','',li).strip().lower())
-    new_middle = "\n" + "\n".join(lis_sorted) + "\n"
-    new_html = before + new_middle + after
-    if new_html != html:
-        INDEX.write_text(new_html, encoding='utf-8')
+    link_li = f'<li><a href="categories/{slug}.html">{name}</a></li>'
+    before, after = html[:m.start(2)], html[m.end(2):]
+    lis = LI_RE.findall(middle)
+    # the block is kept sorted, so splice the new link in rather than re-sort
+    lis.insert(bisect.bisect_right(lis, _li_key(link_li), key=_li_key), link_li)
+    new_middle = "\n" + "\n".join(lis) + "\n"
+    INDEX.write_text(before + new_middle + after, encoding='utf-8')
 
 # ---- Main
-if __name__ == '__main__':
-    issue_title = sys.argv[1] if len(sys.argv) > 1 else ''
-    issue_body  = sys.argv[2] if len(sys.argv) > 2 else ''
+def issue_url(issue_title, issue_body):
+    return first_url(issue_title) or first_url(issue_body)
 
-    url = first_url(issue_title) or first_url(issue_body)
+def fetch_meta_safe(url):
+    # for pool.map: hand failures back as values so one bad URL can't sink the batch
     if not url:
-        print('::error::No URL found in issue'); sys.exit(1)
+        return None
+    try:
+        return fetch_meta(url)
+    except Exception as e:
+        return e
 
-    title, meta_desc, final_url = fetch_meta(url)
+def process_one(issue_title, issue_body, meta=None):
+    if meta is None:
+        url = issue_url(issue_title, issue_body)
+        if not url:
+            print('::error::No URL found in issue'); return None
+        meta = fetch_meta(url)
 
-    # classify (AI or fallback)
-    if USE_AI:
-        # … call ai_categorize here if you keep OpenAI …
-        category_name = fallback_category(title, meta_desc, final_url)
-        category_slug = slugify(category_name)
-        short_title   = title[:60]
-        description   = (meta_desc or f'Resource: {title}')[:220]
-        group_name    = None
-    else:
-        category_name = fallback_category(title, meta_desc, final_url)
-        category_slug = slugify(category_name)
-        short_title   = title[:60]
-        description   = (meta_desc or f'Resource: {title}')[:220]
-        group_name    = None
+    title, meta_desc, final_url = meta
 
-    # issue overrides
+    # issue overrides (read first: a Category: line makes the AI call unnecessary)
     override_cat   = read_override(CATEGORY_RE, issue_body)
     override_grp   = read_override(GROUP_RE,    issue_body)
     override_desc  = read_override(DESC_RE,     issue_body)
     override_title = read_override(TITLE_RE,    issue_body)
-    if override_cat:
-        category_name = override_cat
-        category_slug = slugify(override_cat)
+
+    # classify (AI or fallback)
+    category_name = fallback_category(title, meta_desc, final_url)
+    short_title   = title[:60]
+    description   = (meta_desc or f'Resource: {title}')[:220]
+    group_name    = None
+    if USE_AI and not override_cat:
+        try:
+            ai = ai_categorize(title, meta_desc, final_url)
+            if ai:
+                category_name = ai['category']
+                group_name    = ai.get('group')
+                short_title   = ai.get('short_title', short_title)[:60]
+                description   = ai.get('description', description)[:220]
+        except Exception as e:
+            print(f'::warning::AI categorisation failed, using keyword fallback: {e}')
+
+    if override_cat: category_name = override_cat
     if override_grp: group_name = override_grp
     if override_desc: description = override_desc[:220]
     if override_title: short_title = override_title[:60]
+    category_slug = _slug(category_name)
 
     # ensure page + JSON
     ensure_category_page(category_name, category_slug)
@@ -166,15 +443,74 @@ if __name__ == '__main__':
 
     item = {'title': short_title, 'url': final_url, 'description': description}
     upsert_item(data_json, group_name or 'General', item)
-    json_path.write_text(json.dumps(data_json, indent=2, ensure_ascii=False), encoding='utf-8')
+    save_category_json(data_json, json_path)
 
     # homepage link
     ensure_category_link_on_index(category_name, category_slug)
 
-    # Expose outputs for workflow
+    return short_title, category_name, final_url
+
+def write_outputs(short_title, category_name, final_url):
     gh_out = os.environ.get("GITHUB_OUTPUT")
     if gh_out:
-        with open(gh_out, "a", encoding="utf-8") as f:
-            f.write(f"short_title={short_title}\n")
-            f.write(f"category_name={category_name}\n")
-            f.write(f"url={final_url}\n")
+        payload = f"short_title={short_title}\ncategory_name={category_name}\nurl={final_url}\n".encode()
+        fd = os.open(gh_out, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, payload)
+        finally:
+            os.close(fd)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Add a bookmark from a GitHub issue.')
+    ap.add_argument('issue_title', nargs='?', default='')
+    ap.add_argument('issue_body', nargs='?', default='')
+    ap.add_argument('--batch', metavar='PATH',
+                    help='JSONL file of {"title", "body"} issues to process in one run')
+    args = ap.parse_args(argv)
+
+    if args.batch:
+        from concurrent.futures import ThreadPoolExecutor
+        failed = 0
+        recs = []
+        with open(args.batch, 'rb') as f:
+            for lineno, line in enumerate(f, 1):
+                if not line.strip(): continue
+                try:
+                    rec = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    rec = None
+                if not (isinstance(rec, dict) and all(isinstance(rec.get(k, ''), str) for k in ('title', 'body'))):
+                    print(f'::error::{args.batch}:{lineno}: expected a {{"title", "body"}} object of strings'); failed += 1
+                    continue
+                recs.append(rec)
+        urls = [issue_url(r.get('title', ''), r.get('body', '')) for r in recs]
+        # network-bound, so fetch concurrently; file writes below stay sequential.
+        # Build the shared session up front so workers don't race to create it.
+        _session()
+        with ThreadPoolExecutor(max_workers=POOL_SIZE) as pool:
+            metas = list(pool.map(fetch_meta_safe, urls))
+        for rec, url, meta in zip(recs, urls, metas):
+            label = rec.get('title', '')
+            if not url:
+                print(f'::error::No URL found in issue: {label}'); failed += 1
+                continue
+            if isinstance(meta, Exception):
+                print(f'::error::{label}: {meta}'); failed += 1
+                continue
+            try:
+                process_one(rec.get('title', ''), rec.get('body', ''), meta)
+            except Exception as e:
+                print(f'::error::{label}: {e}'); failed += 1
+        flush_ai_cache()
+        return 1 if failed else 0
+
+    result = process_one(args.issue_title, args.issue_body)
+    flush_ai_cache()
+    if not result:
+        return 1
+    # Expose outputs for workflow
+    write_outputs(*result)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())